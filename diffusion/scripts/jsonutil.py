@@ -0,0 +1,96 @@
+"""JSON helpers shared by the script generators: (de)serialisation and
+extraction of the script JSON from free-form model output."""
+import json
+import re
+from typing import Dict, List
+
+try:
+    import orjson
+except ImportError:  # stdlib fallback, same output modulo whitespace
+    orjson = None
+
+def dumps(obj, indent: bool = True) -> str:
+    # Compact output for prompts: indentation only costs extra input tokens
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else None).decode()
+    if indent:
+        return json.dumps(obj, indent=2, ensure_ascii=False)
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False)
+
+loads = orjson.loads if orjson is not None else json.loads
+
+def write_json(obj, filename: str) -> None:
+    # Serialise up front and write once instead of streaming through text IO
+    if orjson is not None:
+        with open(filename, 'wb') as f:
+            f.write(orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_APPEND_NEWLINE))
+    else:
+        with open(filename, 'w', encoding='utf-8') as f:
+            f.write(dumps(obj) + '\n')
+
+JSON_FENCE_RE = re.compile(r'```json\n(.*?)\n```', re.DOTALL)
+
+_JSON_DECODER = json.JSONDecoder()
+
+def decode_top_level_object(text: str) -> Dict:
+    """Decode the first top-level {...} in text that parses as JSON.
+
+    Only a '{' outside any other object starts a candidate, so a truncated
+    response raises instead of yielding one of its nested items. Returns {}
+    if the text contains no '{' at all.
+    """
+    depth = 0
+    in_string = False
+    escape = False
+    found = False
+    for i, ch in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == '\\':
+                escape = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"' and depth:
+            in_string = True
+        elif ch == '{':
+            if depth == 0:
+                found = True
+                # raw_decode parses one complete value and ignores what follows
+                try:
+                    return _JSON_DECODER.raw_decode(text, i)[0]
+                except json.JSONDecodeError:
+                    pass
+            depth += 1
+        elif ch == '}' and depth:
+            depth -= 1
+    if not found:
+        return {}
+    raise ValueError("JSON extraction failed: no valid JSON object in response")
+
+def extract_json(raw_text: str) -> Dict:
+    """Script JSON from a model response: bare, in a ```json fence, or wrapped in prose."""
+    try:
+        return loads(raw_text)
+    except json.JSONDecodeError:
+        json_match = JSON_FENCE_RE.search(raw_text)
+        if json_match:
+            try:
+                return loads(json_match.group(1))
+            except json.JSONDecodeError:
+                pass
+        return decode_top_level_object(raw_text)
+
+def extract_json_array(raw_text: str) -> List:
+    json_match = JSON_FENCE_RE.search(raw_text)
+    text = json_match.group(1) if json_match else raw_text
+    start = text.find('[')
+    if start == -1:
+        raise ValueError("JSON extraction failed: no array in response")
+    try:
+        items, _ = _JSON_DECODER.raw_decode(text, start)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"JSON extraction failed: {str(e)}")
+    if not isinstance(items, list):
+        raise ValueError("JSON extraction failed: expected an array")
+    return items
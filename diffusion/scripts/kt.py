@@ -1,9 +1,9 @@
 import json
-import re
 from typing import Dict, List, Optional, Generator
 from transformers import AutoModelForCausalLM, AutoTokenizer
 import torch
 import accelerate
+from jsonutil import extract_json
 
 class VideoScriptGenerator:
     """
@@ -223,17 +223,7 @@ class VideoScriptGenerator:
         return ''.join(generated_chunks)
         
     def _extract_json(self, raw_text: str) -> Dict:
-        try:
-            return json.loads(raw_text)
-        except json.JSONDecodeError:
-            try:
-                json_match = re.search(r'```json\n(.*?)\n```', raw_text, re.DOTALL)
-                if json_match:
-                    return json.loads(json_match.group(1))
-                json_match = re.search(r'\{.*\}', raw_text, re.DOTALL)
-                return json.loads(json_match.group()) if json_match else {}
-            except Exception as e:
-                raise ValueError(f"JSON extraction failed: {str(e)}")
+        return extract_json(raw_text)
     
     def generate_script(self, topic: str, duration: int = 60, key_points: Optional[List[str]] = None) -> Generator[str, None, None]:
         prompt = f"""Generate a {duration}-second video script about: {topic}
@@ -242,25 +232,21 @@ class VideoScriptGenerator:
         - Engaging and scientifically accurate narration
         - Cinematic visuals with detailed prompts"""
         
-        buffer = ""
         for chunk in self._generate_content(prompt):
-            buffer += chunk
             yield chunk  # Stream data as it's received
     
     def refine_script(self, existing_script: Dict, feedback: str) -> Generator[str, None, None]:
         prompt = f"""Refine this script based on feedback:
-        Existing Script: {json.dumps(existing_script, indent=2)}
+        Existing Script: {json.dumps(existing_script, separators=(',', ':'), ensure_ascii=False)}
         Feedback: {feedback}
         Maintain structure, valid parameters, and timestamp continuity."""
         
-        buffer = ""
         for chunk in self._generate_content(prompt):
-            buffer += chunk
             yield chunk  # Stream refinement updates
     
     def save_script(self, script: Dict, filename: str) -> None:
-        with open(filename, 'w') as f:
-            json.dump(script, f, indent=2)
+        with open(filename, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(script, indent=2, ensure_ascii=False))
 
 # Example Usage
 if __name__ == "__main__":
@@ -276,12 +262,12 @@ if __name__ == "__main__":
             key_points=["History of Hot Wheels", "Rare models", "Future designs"]
         )
         
-        full_script = ""
+        full_script_parts = []
         for chunk in script_chunks:
             print(chunk, end="", flush=True)  # Print streaming data in real time
-            full_script += chunk
+            full_script_parts.append(chunk)
         
-        script_json = generator._extract_json(full_script)
+        script_json = generator._extract_json("".join(full_script_parts))
         generator.save_script(script_json, "scripts.json")
 
         feedback = input("\nProvide feedback (or type 'no' to skip refinement): ")
@@ -289,12 +275,12 @@ if __name__ == "__main__":
             print("Refining Script...")
             refined_chunks = generator.refine_script(script_json, feedback)
             
-            full_refined_script = ""
+            full_refined_script_parts = []
             for chunk in refined_chunks:
                 print(chunk, end="", flush=True)
-                full_refined_script += chunk
+                full_refined_script_parts.append(chunk)
             
-            refined_json = generator._extract_json(full_refined_script)
+            refined_json = generator._extract_json("".join(full_refined_script_parts))
             generator.save_script(refined_json, "scripts.json")
     except Exception as e:
         print(f"Script generation failed: {str(e)}")
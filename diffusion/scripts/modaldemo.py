@@ -1,11 +1,11 @@
 import json
-import re
+from threading import Thread
 from typing import Dict, List, Optional, Generator
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from transformers import AutoModelForCausalLM, AutoTokenizer, TextIteratorStreamer
 import torch
 import accelerate
 import modal
-
+from jsonutil import extract_json
 
 app = modal.App(name="script_test2_app")
 
@@ -13,11 +13,12 @@ image = modal.Image.debian_slim().pip_install(
     "torch",
     "transformers",
     "accelerate"
-)
+).add_local_python_source("jsonutil")
 
 @app.cls(
     image = image,
-    gpu="A10G"  
+    gpu="A10G",
+    container_idle_timeout=300  # keep the loaded model warm between calls
 )
 class VideoScriptGenerator:
     """
@@ -26,14 +27,19 @@ class VideoScriptGenerator:
     - Multi-stage generation
     - Feedback-based refinement
     - Live script generation
+    - Batched generation for several prompts
     """
     
-    def __init__(self, model_name: str = "meta-llama/Llama-3.1-8B"):
+    model_name: str = "meta-llama/Llama-3.1-8B"
+    
+    @modal.enter()
+    def load(self):
+        # Runs once per container, so weights are loaded once and reused by every call
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
     
         # Load tokenizer with padding settings
         self.tokenizer = AutoTokenizer.from_pretrained(
-            model_name, 
+            self.model_name, 
             padding_side='left',  # Ensure padding is on the left side
             truncation_side='left'
         )
@@ -44,7 +50,7 @@ class VideoScriptGenerator:
     
         # Load model with additional configuration
         self.model = AutoModelForCausalLM.from_pretrained(
-            model_name,
+            self.model_name,
             torch_dtype=torch.float16 if self.device == "cuda" else torch.float32,
             device_map="auto",
             # Add pad token configuration
@@ -208,6 +214,9 @@ class VideoScriptGenerator:
         # Create a list to store generated chunks
         generated_chunks = []
         
+        # The same streamer must be passed to generate() and iterated here
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True)
+        
         # Set up streaming
         def generate_stream():
             output = self.model.generate(
@@ -217,7 +226,7 @@ class VideoScriptGenerator:
                 do_sample=True,
                 temperature=0.7,
                 top_p=0.9,
-                streamer=TextIteratorStreamer(self.tokenizer, skip_prompt=True)
+                streamer=streamer
             )
             return output
 
@@ -226,7 +235,7 @@ class VideoScriptGenerator:
         generation_thread.start()
         
         # Yield chunks as they are generated
-        for chunk in TextIteratorStreamer(self.tokenizer, skip_prompt=True):
+        for chunk in streamer:
             yield chunk
             generated_chunks.append(chunk)
         
@@ -235,19 +244,33 @@ class VideoScriptGenerator:
         
         # Return full generated text
         return ''.join(generated_chunks)
-    @modal.method()   
-    def _extract_json(self, raw_text: str) -> Dict:
-        try:
-            return json.loads(raw_text)
-        except json.JSONDecodeError:
-            try:
-                json_match = re.search(r'```json\n(.*?)\n```', raw_text, re.DOTALL)
-                if json_match:
-                    return json.loads(json_match.group(1))
-                json_match = re.search(r'\{.*\}', raw_text, re.DOTALL)
-                return json.loads(json_match.group()) if json_match else {}
-            except Exception as e:
-                raise ValueError(f"JSON extraction failed: {str(e)}")
+    @modal.method()
+    def generate_batch(self, prompts: List[str], batch_size: int = 8, max_new_tokens: int = 512) -> List[str]:
+        # Left padding (set in load) lets prompts of different lengths share one forward pass
+        outputs = []
+        for i in range(0, len(prompts), batch_size):
+            inputs = self.tokenizer(
+                prompts[i:i + batch_size],
+                return_tensors="pt",
+                padding=True,
+                truncation=True,
+                max_length=2048
+            ).to(self.device)
+            with torch.inference_mode():
+                generated = self.model.generate(
+                    input_ids=inputs.input_ids,
+                    attention_mask=inputs.attention_mask,
+                    max_new_tokens=max_new_tokens,
+                    do_sample=True,
+                    temperature=0.7,
+                    top_p=0.9
+                )
+            # Drop the (padded) prompt tokens, keep only the completion
+            outputs.extend(self.tokenizer.batch_decode(
+                generated[:, inputs.input_ids.shape[1]:],
+                skip_special_tokens=True
+            ))
+        return outputs
     @modal.method()
     def generate_script(self, topic: str, duration: int = 60, key_points: Optional[List[str]] = None) -> Generator[str, None, None]:
         prompt = f"""Generate a {duration}-second video script about: {topic}
@@ -256,25 +279,23 @@ class VideoScriptGenerator:
         - Engaging and scientifically accurate narration
         - Cinematic visuals with detailed prompts"""
         
-        buffer = ""
         for chunk in self._generate_content(prompt):
-            buffer += chunk
             yield chunk  # Stream data as it's received
     @modal.method()
     def refine_script(self, existing_script: Dict, feedback: str) -> Generator[str, None, None]:
         prompt = f"""Refine this script based on feedback:
-        Existing Script: {json.dumps(existing_script, indent=2)}
+        Existing Script: {json.dumps(existing_script, separators=(',', ':'), ensure_ascii=False)}
         Feedback: {feedback}
         Maintain structure, valid parameters, and timestamp continuity."""
         
-        buffer = ""
         for chunk in self._generate_content(prompt):
-            buffer += chunk
             yield chunk  # Stream refinement updates
-    @modal.method()
-    def save_script(self, script: Dict, filename: str) -> None:
-        with open(filename, 'w') as f:
-            json.dump(script, f, indent=2)
+
+# JSON extraction (`extract_json`) and saving run locally: they need no GPU,
+# and a file written inside the remote container would be lost with it
+def save_script(script: Dict, filename: str) -> None:
+    with open(filename, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(script, indent=2, ensure_ascii=False))
 
 @app.local_entrypoint()
 def main():
@@ -287,26 +308,26 @@ def main():
             key_points=["History of Hot Wheels", "Rare models", "Future designs"]
         )
 
-        full_script = ""
+        full_script_parts = []
         for chunk in script_chunks:
             print(chunk, end="", flush=True)  # Print streaming data in real-time
-            full_script += chunk
+            full_script_parts.append(chunk)
 
-        script_json = generator._extract_json_remote_gen(full_script)
-        generator.save_script_remote_gen(script_json, "scripts.json")
+        script_json = extract_json("".join(full_script_parts))
+        save_script(script_json, "scripts.json")
 
         feedback = input("\nProvide feedback (or type 'no' to skip refinement): ")
         if feedback.lower() != "no":
             print("Refining Script...")
-            refined_chunks = generator.refine_script_remote_gen(script_json, feedback)
+            refined_chunks = generator.refine_script.remote_gen(script_json, feedback)
 
-            full_refined_script = ""
+            full_refined_script_parts = []
             for chunk in refined_chunks:
                 print(chunk, end="", flush=True)
-                full_refined_script += chunk
+                full_refined_script_parts.append(chunk)
 
-            refined_json = generator._extract_json_remote_gen(full_refined_script)
-            generator.save_script_remote_gen(refined_json, "scripts.json")
+            refined_json = extract_json("".join(full_refined_script_parts))
+            save_script(refined_json, "scripts.json")
     except Exception as e:
         print(f"Script generation failed: {str(e)}")
         
@@ -1,8 +1,16 @@
-import json
-import re
+import asyncio
 import google.generativeai as genai
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Union
 from serpapi import GoogleSearch
+from jsonutil import dumps, extract_json, write_json
+
+# Upper bound on concurrent per-section segmentation requests
+SEGMENTATION_CONCURRENCY = 8
+# Shortest slice worth a request of its own (the minimum segment length)
+MIN_SECTION_SECONDS = 5
+
+def _format_timestamp(seconds: int) -> str:
+    return f"{seconds // 60:02d}:{seconds % 60:02d}"
 
 class VideoScriptGenerator:
     def __init__(self, api_key: str, serp_api_key: str):
@@ -211,86 +219,128 @@ class VideoScriptGenerator:
         except Exception as e:
             return ""
     
-    def _enhance_with_web_context(self, script: Dict, topic: str) -> Dict:
-        web_context = self._search_web(topic)
+    def _enhance_with_web_context(self, script: Dict, web_context: str) -> Dict:
         script["additional_context"] = web_context
         return script
     
-    def _generate_content(self, prompt: str, system_prompt: str) -> str:
+    async def _generate_content(self, prompt: str, system_prompt: str) -> str:
         try:
-            response = self.model.generate_content(contents=[system_prompt, prompt])
+            response = await self.model.generate_content_async(contents=[system_prompt, prompt])
             return response.text
         except Exception as e:
             raise RuntimeError(f"API call failed: {str(e)}")
     
     def _extract_json(self, raw_text: str) -> Dict:
-        try:
-            return json.loads(raw_text)
-        except json.JSONDecodeError:
-            try:
-                json_match = re.search(r'```json\n(.*?)\n```', raw_text, re.DOTALL)
-                if json_match:
-                    return json.loads(json_match.group(1))
-                json_match = re.search(r'\{.*\}', raw_text, re.DOTALL)
-                return json.loads(json_match.group()) if json_match else {}
-            except Exception as e:
-                raise ValueError(f"JSON extraction failed: {str(e)}")
+        return extract_json(raw_text)
     
-    def generate_script(self, topic: str, duration: int = 60, key_points: Optional[List[str]] = None) -> Dict:
-        web_context = self._search_web(topic)
+    async def generate_script(self, topic: str, duration: int = 60, key_points: Optional[List[str]] = None) -> Dict:
+        # SerpAPI's client is blocking, keep it off the event loop
+        web_context = await asyncio.to_thread(self._search_web, topic)
         initial_prompt = f"""Generate an initial video script outline for a {duration}-second video about: {topic}.
         Key Points: {key_points or 'Comprehensive coverage'}
         Additional Context: {web_context}
         Focus on the overall narrative and key sections, but do *not* include timestamps or detailed technical parameters yet."""
         
-        raw_initial_output = self._generate_content(initial_prompt, self.system_prompt_initial)
+        raw_initial_output = await self._generate_content(initial_prompt, self.system_prompt_initial)
         initial_script = self._extract_json(raw_initial_output)
         
-        enhanced_script = self._enhance_with_web_context(initial_script, topic)
+        enhanced_script = self._enhance_with_web_context(initial_script, web_context)
         
-        segmentation_prompt = f"""
-        Here is the initial script draft:
-        {json.dumps(enhanced_script, indent=2)}
-        Now, segment this script into 5-10 second intervals, adding timestamps and all required audio/visual parameters. The total duration should be approximately {duration} seconds.
-        """
+        sections = enhanced_script.get('key_sections') or []
+        # Too short a video to give every section its own slice: segment in one go
+        if not sections or duration < MIN_SECTION_SECONDS * len(sections):
+            segmentation_prompt = f"""
+            Here is the initial script draft:
+            {dumps(enhanced_script, indent=False)}
+            Now, segment this script into 5-10 second intervals, adding timestamps and all required audio/visual parameters. The total duration should be approximately {duration} seconds.
+            """
+            raw_segmented_output = await self._generate_content(segmentation_prompt, self.system_prompt_segmentation)
+            segmented_script = self._extract_json(raw_segmented_output)
+            segmented_script['topic'] = enhanced_script['topic']
+            return segmented_script
         
-        raw_segmented_output = self._generate_content(segmentation_prompt, self.system_prompt_segmentation)
-        segmented_script = self._extract_json(raw_segmented_output)
-        segmented_script['topic'] = enhanced_script['topic']
+        # One small request per section instead of one long one for the whole
+        # script; each section gets its own slice of the timeline
+        seconds = [duration // len(sections)] * len(sections)
+        seconds[-1] += duration % len(sections)
+        offsets = [sum(seconds[:i]) for i in range(len(sections))]
+        semaphore = asyncio.Semaphore(SEGMENTATION_CONCURRENCY)
         
-        return segmented_script
+        async def segment(i: int) -> Dict:
+            async with semaphore:
+                return await self._segment_section(enhanced_script, i, offsets[i], seconds[i])
+        
+        parts = await asyncio.gather(*(segment(i) for i in range(len(sections))))
+        return {
+            'topic': enhanced_script['topic'],
+            'description': parts[0].get('description') or enhanced_script.get('overall_narrative', ''),
+            'audio_script': [item for part in parts for item in part.get('audio_script', [])],
+            'visual_script': [item for part in parts for item in part.get('visual_script', [])],
+        }
     
-    def refine_script(self, existing_script: Dict, feedback: str) -> Dict:
+    async def _segment_section(self, script: Dict, index: int, start: int, seconds: int) -> Dict:
+        draft = {
+            'topic': script.get('topic'),
+            'overall_narrative': script.get('overall_narrative'),
+            'key_sections': [script['key_sections'][index]],
+            'additional_context': script.get('additional_context'),
+        }
+        prompt = f"""
+        Here is section {index + 1} of {len(script['key_sections'])} of the initial script draft:
+        {dumps(draft, indent=False)}
+        Now, segment only this section into 5-10 second intervals, adding timestamps and all required audio/visual parameters.
+        Timestamps must start at {_format_timestamp(start)} and end by {_format_timestamp(start + seconds)} (about {seconds} seconds).
+        """
+        raw_output = await self._generate_content(prompt, self.system_prompt_segmentation)
+        part = self._extract_json(raw_output)
+        # An empty part would leave a hole in the merged timeline
+        if not isinstance(part, dict) or not part.get('audio_script') or not part.get('visual_script'):
+            section = script['key_sections'][index]
+            title = section.get('section_title') if isinstance(section, dict) else None
+            raise ValueError(f"Segmentation failed for section {index + 1} ({title or 'untitled'}): "
+                             "no audio_script/visual_script in response")
+        return part
+    
+    async def generate_scripts(self, jobs: List[Dict]) -> List[Union[Dict, BaseException]]:
+        """Generate one script per job ({'topic', 'duration', 'key_points'}) concurrently.
+
+        A failed job is returned as its exception instead of aborting the others.
+        """
+        return await asyncio.gather(*(self.generate_script(**job) for job in jobs), return_exceptions=True)
+    
+    async def refine_script(self, existing_script: Dict, feedback: str) -> Dict:
         prompt = f"""Refine this script based on feedback:
-        Existing Script: {json.dumps(existing_script, indent=2)}
+        Existing Script: {dumps(existing_script, indent=False)}
         Feedback: {feedback}
         """
-        raw_output = self._generate_content(prompt, self.system_prompt_segmentation)
+        raw_output = await self._generate_content(prompt, self.system_prompt_segmentation)
         return self._extract_json(raw_output)
     
     def save_script(self, script: Dict, filename: str) -> None:
-        with open(filename, 'w') as f:
-            json.dump(script, f, indent=2)
+        write_json(script, filename)
 
-if __name__ == "__main__":
+async def main():
     generator = VideoScriptGenerator(api_key="Enter your gemini api key", serp_api_key="enter your serp api key")
     
     try:
-        script = generator.generate_script(
+        script = await generator.generate_script(
             topic="Neural Networks in Medical Imaging",
             duration=90,
             key_points=["Diagnosis accuracy", "Pattern recognition", "Case studies"]
         )
         print("Initial Script:")
-        print(json.dumps(script, indent=2))
+        print(dumps(script))
         
         feedback = input("Please provide feedback on the script (or type 'no' to skip refinement): ")
         if feedback.lower() != "no":
-            refined_script = generator.refine_script(script, feedback)
+            refined_script = await generator.refine_script(script, feedback)
             print("\nRefined Script:")
-            print(json.dumps(refined_script, indent=2))
+            print(dumps(refined_script))
             generator.save_script(refined_script, "scripts.json")
         else:
             generator.save_script(script, "scripts.json")
     except Exception as e:
         print(f"Script generation failed: {str(e)}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
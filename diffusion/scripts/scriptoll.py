@@ -1,21 +1,289 @@
+import asyncio
+import hashlib
+import contextlib
+import contextvars
 import json
-import re
-from typing import Dict, List, Optional, Generator
-from ollama import chat
+import math
+import os
+import threading
+import time
+from typing import Annotated, AsyncGenerator, AsyncIterator, Awaitable, Callable, Dict, List, MutableMapping, Optional, Generator, Tuple, Union
+import httpx
+import msgspec
+from ollama import AsyncClient
+from jsonutil import dumps, extract_json, extract_json_array, loads, write_json
 
-class VideoScriptGenerator:
+# Typed script model, the one definition of the script fields and ranges;
+# decoding and validation happen in one C pass
+class AudioSegment(msgspec.Struct):
+    timestamp: str
+    text: str
+    speed: Annotated[float, msgspec.Meta(ge=0.9, le=1.1)]
+    pitch: Annotated[float, msgspec.Meta(ge=0.9, le=1.2)]
+    speaker: str = 'default'
+    emotion: str = 'neutral'
+
+class VisualSegment(msgspec.Struct):
+    timestamp_start: str
+    timestamp_end: str
+    prompt: str
+    guidance_scale: Annotated[float, msgspec.Meta(ge=11.0, le=14.0)]
+    steps: Annotated[int, msgspec.Meta(ge=50, le=100)]
+    negative_prompt: str = ''
+    style: str = 'realistic'
+    seed: Optional[int] = None
+    width: int = 1024
+    height: int = 576
+
+class Script(msgspec.Struct):
+    topic: str
+    audio_script: List[AudioSegment]
+    visual_script: List[VisualSegment]
+    description: str = ''
+
+# Concurrent requests are only served in parallel if the Ollama server is
+# started with OLLAMA_NUM_PARALLEL > 1 (and OLLAMA_MAX_LOADED_MODELS large
+# enough to keep the model resident); otherwise they are queued server side.
+OLLAMA_NUM_PARALLEL = int(os.environ.get('OLLAMA_NUM_PARALLEL', '4'))
+
+# A fixed context size and keep-alive keep the model (and its cached prompt
+# prefix) loaded between calls; changing num_ctx forces a reload.
+OLLAMA_NUM_CTX = 8192
+OLLAMA_KEEP_ALIVE = '10m'
+
+# Rough sizes for packing `generate_scripts` jobs into OLLAMA_NUM_CTX: about
+# 4 characters per token, and a 60-second script is about 2k tokens
+CHARS_PER_TOKEN = 4
+SCRIPT_TOKENS_PER_SECOND = 35
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+_sync_client: Optional[AsyncClient] = None
+# Client shared by the requests of one `agenerate_many` batch
+_batch_client: contextvars.ContextVar[Optional[AsyncClient]] = contextvars.ContextVar('scriptoll_batch_client', default=None)
+
+def _new_client() -> AsyncClient:
+    return AsyncClient(
+        timeout=httpx.Timeout(300.0, connect=10.0),
+        limits=httpx.Limits(max_keepalive_connections=40, max_connections=100, keepalive_expiry=30.0)
+    )
+
+@contextlib.asynccontextmanager
+async def _client_scope() -> AsyncIterator[AsyncClient]:
+    """AsyncClient for one call, closed with its connections when done.
+
+    httpx connections are bound to the loop that opened them. The sync shim's
+    loop lives as long as the process, so it keeps one client for good; on any
+    other loop (e.g. one started by `asyncio.run`) a client lasts for a single
+    call or `agenerate_many` batch.
     """
-    Video script generator using Ollama with:
-    - Structured JSON output
-    - Multi-stage generation
-    - Feedback-based refinement
-    
-    - Live script generation
+    global _sync_client
+    client = _batch_client.get()
+    if client is None and asyncio.get_running_loop() is _loop:
+        if _sync_client is None:
+            _sync_client = _new_client()
+        client = _sync_client
+    if client is not None:
+        yield client
+        return
+    async with _new_client() as client:
+        yield client
+
+def _get_sync_loop() -> asyncio.AbstractEventLoop:
+    """Event loop backing the sync API, running on its own daemon thread.
+
+    Running it on a separate thread lets the sync methods work from code that
+    already has a loop running (Jupyter, async callers), and keeping it alive
+    keeps the pooled connections of its AsyncClient valid between calls.
     """
-    
-    def __init__(self, model: str = 'llamayt'):
-        self.model = model
-        self.system_prompt = """You are a professional video script generator. 
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='scriptoll-sync-loop', daemon=True).start()
+    return _loop
+
+def _iter_sync(agen: AsyncGenerator[str, None]) -> Generator[str, None, None]:
+    """Drive an async generator from sync code on the background loop."""
+    loop = _get_sync_loop()
+    try:
+        while True:
+            try:
+                yield asyncio.run_coroutine_threadsafe(agen.__anext__(), loop).result()
+            except StopAsyncIteration:
+                return
+    finally:
+        # Also runs when the consumer stops iterating early
+        asyncio.run_coroutine_threadsafe(agen.aclose(), loop).result()
+
+class LLMCache:
+    """
+    Response cache for Ollama generations:
+    - Exact tier keyed on sha256(model, system prompt, user prompt)
+    - Optional semantic tier matching prompt embeddings by cosine similarity
+
+    `backend` is any mapping, e.g. a dict (default) or a `shelve` file to
+    persist responses across runs. Embeddings are stored with their entries,
+    so both tiers persist and expire together.
+    """
+
+    def __init__(self, backend: Optional[MutableMapping] = None, ttl: Optional[float] = 3600,
+                 embed_model: Optional[str] = None, threshold: float = 0.92):
+        self.backend = {} if backend is None else backend
+        self.ttl = ttl
+        self.embed_model = embed_model
+        self.threshold = threshold
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(model: str, system: str, prompt: str) -> str:
+        payload = dumps({'model': model, 'sys': system, 'user': prompt}, indent=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _normalize(vector: List[float]) -> List[float]:
+        norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+        return [x / norm for x in vector]
+
+    def _live(self, key: str, entry: Optional[Tuple]) -> bool:
+        if entry is None:
+            return False
+        if entry[0] is not None and entry[0] < time.time():
+            del self.backend[key]
+            return False
+        return True
+
+    def prune(self) -> None:
+        """Drop expired entries."""
+        for key in list(self.backend.keys()):
+            self._live(key, self.backend.get(key))
+
+    def _get_similar(self, model: str, system: str, embedding: List[float]) -> Optional[str]:
+        scope = self.key(model, system, '')
+        query = self._normalize(embedding)
+        best_score, best_text = -1.0, None
+        for key in list(self.backend.keys()):
+            entry = self.backend.get(key)
+            if not self._live(key, entry):
+                continue
+            _, text, entry_scope, vector = entry
+            if vector is None or entry_scope != scope:
+                continue
+            score = sum(a * b for a, b in zip(query, vector))
+            if score > best_score:
+                best_score, best_text = score, text
+        return best_text if best_score >= self.threshold else None
+
+    async def lookup(self, model: str, system: str, prompt: str,
+                     embed: Optional[Callable[[str], Awaitable[List[float]]]] = None) -> Tuple[Optional[str], Optional[List[float]]]:
+        """Return (cached text or None, prompt embedding or None).
+
+        The prompt is only embedded after an exact miss and only when the
+        semantic tier is enabled; pass the embedding on to `set`.
+        """
+        key = self.key(model, system, prompt)
+        entry = self.backend.get(key)
+        if self._live(key, entry):
+            self.hits += 1
+            return entry[1], None
+        embedding = None
+        if self.embed_model and embed is not None:
+            embedding = await embed(prompt)
+            text = self._get_similar(model, system, embedding)
+            if text is not None:
+                self.semantic_hits += 1
+                return text, embedding
+        self.misses += 1
+        return None, embedding
+
+    def set(self, model: str, system: str, prompt: str, text: str, embedding: Optional[List[float]] = None) -> None:
+        self.prune()
+        expires_at = time.time() + self.ttl if self.ttl else None
+        vector = self._normalize(embedding) if embedding is not None else None
+        self.backend[self.key(model, system, prompt)] = (expires_at, text, self.key(model, system, ''), vector)
+
+    def stats(self) -> Dict[str, int]:
+        return {'hits': self.hits, 'semantic_hits': self.semantic_hits, 'misses': self.misses}
+
+class ScriptSegmentParser:
+    """
+    Incremental scanner for a streamed script. `feed` returns every
+    `audio_script` / `visual_script` item whose closing brace has arrived,
+    so downstream work can start before generation finishes. Text before
+    the first '{' (e.g. a markdown fence) and after the object closes
+    (`complete` is set) is skipped; if an item fails to parse the scanner
+    stops (`failed` is set) and `text` can go through `_extract_json`. See
+    `VideoScriptGenerator.generate_segments`.
+    """
+    SEGMENT_KEYS = ('audio_script', 'visual_script')
+
+    def __init__(self):
+        self._parts: List[str] = []
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escape = False
+        self._token: Optional[List[str]] = None  # string being read in the top-level object
+        self._key: Optional[str] = None
+        self._array_key: Optional[str] = None
+        self._item: Optional[List[str]] = None  # segment being read
+        self.failed = False
+        self.complete = False
+
+    @property
+    def text(self) -> str:
+        return "".join(self._parts)
+
+    def feed(self, chunk: str) -> List[Tuple[str, Dict]]:
+        self._parts.append(chunk)
+        ready = []
+        if self.failed:
+            return ready
+        for ch in chunk:
+            if not self._stack and (self.complete or ch != '{'):
+                continue  # prose or markdown fence around the object
+            if self._item is not None:
+                self._item.append(ch)
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._token is not None:
+                        self._key = "".join(self._token)
+                        self._token = None
+                elif self._token is not None:
+                    self._token.append(ch)
+            elif ch == '"':
+                self._in_string = True
+                if len(self._stack) == 1:
+                    self._token = []
+            elif ch == '[' or ch == '{':
+                if len(self._stack) == 1 and ch == '[':
+                    self._array_key = self._key
+                elif (len(self._stack) == 2 and ch == '{' and self._stack[1] == '['
+                      and self._array_key in self.SEGMENT_KEYS):
+                    self._item = ['{']
+                self._stack.append(ch)
+            elif (ch == ']' or ch == '}') and self._stack:
+                self._stack.pop()
+                if not self._stack:
+                    self.complete = True
+                if self._item is not None and len(self._stack) == 2:
+                    try:
+                        ready.append((self._array_key, loads("".join(self._item))))
+                    except json.JSONDecodeError:
+                        self.failed = True
+                        return ready
+                    self._item = None
+        return ready
+
+# Frozen at import so every request sends a byte-identical system prefix
+# that Ollama can keep in its prompt (KV) cache
+_SYSTEM_PROMPT = """You are a professional video script generator. 
         Generate JSON output strictly following this structure:
         {
             "topic": "Topic Name",
@@ -156,62 +424,233 @@ class VideoScriptGenerator:
   ]
 }
         Ensure audio and visual timestamps are synchronized.
-        """
+        """.strip()
+_SYSTEM_MSG = {'role': 'system', 'content': _SYSTEM_PROMPT}
+
+class VideoScriptGenerator:
+    """
+    Video script generator using Ollama with:
+    - Structured JSON output
+    - Multi-stage generation
+    - Feedback-based refinement
     
-    def _generate_content(self, prompt: str) -> Generator[str, None, None]:
-        stream = chat(
-            model=self.model,
-            messages=[{'role': 'system', 'content': self.system_prompt},
-                      {'role': 'user', 'content': prompt}],
-            stream=True
-        )
-        
-        for chunk in stream:
-            yield chunk['message']['content']
+    - Live script generation
+    - Concurrent generation of several scripts (async API)
+    - Optional caching of responses for repeated prompts
+    """
+    
+    def __init__(self, model: str = 'llamayt', cache: Optional[LLMCache] = None):
+        self.model = model
+        self.cache = cache  # None disables caching
+        self.system_prompt = _SYSTEM_PROMPT
+        self._system_msg = _SYSTEM_MSG
+    
+    async def _embed(self, client: AsyncClient, prompt: str) -> List[float]:
+        response = await client.embed(model=self.cache.embed_model, input=prompt)
+        return response['embeddings'][0]
+    
+    async def _generate_content(self, prompt: str) -> AsyncGenerator[str, None]:
+        async with _client_scope() as client:
+            embedding = None
+            if self.cache is not None:
+                cached, embedding = await self.cache.lookup(self.model, self.system_prompt, prompt,
+                                                            lambda text: self._embed(client, text))
+                if cached is not None:
+                    yield cached
+                    return
+            
+            stream = await client.chat(
+                model=self.model,
+                messages=[self._system_msg, {'role': 'user', 'content': prompt}],
+                stream=True,
+                options={'num_ctx': OLLAMA_NUM_CTX},
+                keep_alive=OLLAMA_KEEP_ALIVE
+            )
+            
+            parts = []
+            async for chunk in stream:
+                parts.append(chunk['message']['content'])
+                yield chunk['message']['content']
+        if self.cache is not None:
+            self.cache.set(self.model, self.system_prompt, prompt, "".join(parts), embedding)
+    
+    async def _collect(self, prompt: str, semaphore: Optional[asyncio.Semaphore] = None) -> str:
+        if semaphore is None:
+            return "".join([chunk async for chunk in self._generate_content(prompt)])
+        async with semaphore:
+            return "".join([chunk async for chunk in self._generate_content(prompt)])
+    
+    async def agenerate_many(self, prompts: List[str], limit: Optional[int] = OLLAMA_NUM_PARALLEL) -> List[Union[str, BaseException]]:
+        """Run several prompts concurrently, at most `limit` in flight.
+
+        Failed prompts are returned as their exception instead of aborting the batch.
+        """
+        semaphore = asyncio.Semaphore(limit) if limit else None
+        async with _client_scope() as client:
+            # gather's tasks copy the current context, so they all see the client
+            token = _batch_client.set(client)
+            try:
+                tasks = [self._collect(prompt, semaphore) for prompt in prompts]
+                return await asyncio.gather(*tasks, return_exceptions=True)
+            finally:
+                _batch_client.reset(token)
     
     def _extract_json(self, raw_text: str) -> Dict:
+        return extract_json(raw_text)
+    
+    def decode_script(self, raw_text: str) -> Script:
+        """Decode and validate a script into typed structs.
+
+        Keys outside the schema (e.g. `strength`) are dropped.
+        """
         try:
-            return json.loads(raw_text)
-        except json.JSONDecodeError:
-            try:
-                json_match = re.search(r'```json\n(.*?)\n```', raw_text, re.DOTALL)
-                if json_match:
-                    return json.loads(json_match.group(1))
-                json_match = re.search(r'\{.*\}', raw_text, re.DOTALL)
-                return json.loads(json_match.group()) if json_match else {}
-            except Exception as e:
-                raise ValueError(f"JSON extraction failed: {str(e)}")
+            return msgspec.json.decode(raw_text, type=Script)
+        except msgspec.ValidationError:
+            raise
+        except msgspec.DecodeError:
+            # Not bare JSON (fenced or wrapped in prose): extract first
+            return msgspec.convert(self._extract_json(raw_text), type=Script)
     
-    def generate_script(self, topic: str, duration: int = 60, key_points: Optional[List[str]] = None) -> Generator[str, None, None]:
-        prompt = f"""Generate a {duration}-second video script about: {topic}
+    def _extract_json_array(self, raw_text: str) -> List[Dict]:
+        return extract_json_array(raw_text)
+    
+    def _validate_script(self, script: Dict) -> bool:
+        # Script is the single source of the field and range rules;
+        # msgspec.ValidationError subclasses ValueError
+        msgspec.convert(script, type=Script)
+        return True
+    
+    def _script_prompt(self, topic: str, duration: int = 60, key_points: Optional[List[str]] = None) -> str:
+        return f"""Generate a {duration}-second video script about: {topic}
         Key Points: {key_points or 'Comprehensive coverage'}
         - At least {duration//5} segments (5-second intervals)
         - Engaging and scientifically accurate narration
         - Cinematic visuals with detailed prompts"""
+    
+    async def agenerate_scripts(self, jobs: List[Dict]) -> List[Union[Dict, BaseException]]:
+        """Generate one script per job ({'topic', 'duration', 'key_points'}) concurrently."""
+        prompts = [self._script_prompt(**job) for job in jobs]
+        results = await self.agenerate_many(prompts)
+        scripts = []
+        for result in results:
+            if isinstance(result, BaseException):
+                scripts.append(result)
+                continue
+            try:
+                scripts.append(self._extract_json(result))
+            except ValueError as e:
+                scripts.append(e)
+        return scripts
+    
+    def _batch_prompt(self, jobs: List[Dict]) -> str:
+        return f"""Return a JSON array with one element per job, in the same order.
+        Each element is a complete video script for its job:
+        - At least duration/5 segments (5-second intervals)
+        - Engaging and scientifically accurate narration
+        - Cinematic visuals with detailed prompts
+        Jobs:
+        {dumps(jobs, indent=False)}"""
+    
+    def _batch_jobs(self, jobs: List[Dict]) -> List[List[Dict]]:
+        """Split jobs into batches whose prompts and scripts fit in OLLAMA_NUM_CTX."""
+        budget = OLLAMA_NUM_CTX - (len(self.system_prompt) + len(self._batch_prompt([]))) // CHARS_PER_TOKEN
+        batches, used = [], 0
+        for job in jobs:
+            tokens = len(dumps(job, indent=False)) // CHARS_PER_TOKEN + job['duration'] * SCRIPT_TOKENS_PER_SECOND
+            if batches and used + tokens <= budget:
+                batches[-1].append(job)
+                used += tokens
+            else:
+                batches.append([job])
+                used = tokens
+        return batches
+    
+    def generate_scripts(self, jobs: List[Dict]) -> List[Union[Dict, BaseException]]:
+        """Generate scripts for several jobs ({'topic', 'duration', 'key_points'}), several jobs per request.
+
+        Jobs are packed into as few requests as fit in OLLAMA_NUM_CTX, so the
+        system prompt is prefilled once per batch; batches run concurrently.
+        Like `agenerate_scripts`, a job whose script fails (request, extraction
+        or validation) gets its exception in place of the script. Use
+        `agenerate_scripts` instead to send one concurrent request per job.
+        """
+        jobs = [{'topic': job['topic'],
+                 'duration': job.get('duration', 60),
+                 'key_points': job.get('key_points') or 'Comprehensive coverage'} for job in jobs]
+        batches = self._batch_jobs(jobs)
+        prompts = [self._batch_prompt(batch) for batch in batches]
+        results = asyncio.run_coroutine_threadsafe(self.agenerate_many(prompts), _get_sync_loop()).result()
         
-        buffer = ""
-        for chunk in self._generate_content(prompt):
-            buffer += chunk
+        scripts = []
+        for batch, result in zip(batches, results):
+            if not isinstance(result, BaseException):
+                try:
+                    result = self._extract_json_array(result)
+                    if len(result) != len(batch):
+                        raise ValueError(f"Expected {len(batch)} scripts, got {len(result)}")
+                except ValueError as e:
+                    result = e
+            if isinstance(result, BaseException):
+                scripts.extend([result] * len(batch))
+                continue
+            for script in result:
+                try:
+                    self._validate_script(script)
+                    scripts.append(script)
+                except ValueError as e:
+                    scripts.append(e)
+        return scripts
+    
+    def generate_script(self, topic: str, duration: int = 60, key_points: Optional[List[str]] = None) -> Generator[str, None, None]:
+        prompt = self._script_prompt(topic, duration, key_points)
+        
+        for chunk in _iter_sync(self._generate_content(prompt)):
             yield chunk  # Stream data as it's received
     
+    def generate_segments(self, topic: str, duration: int = 60, key_points: Optional[List[str]] = None,
+                          parser: Optional[ScriptSegmentParser] = None) -> Generator[Tuple[str, Dict], None, None]:
+        """Like generate_script, but yields ('audio_script' | 'visual_script', item) as each segment completes.
+
+        If a segment fails to parse, the script never closes or no segment was
+        found (e.g. the model wrote a '{...}' aside before the script), the full
+        response goes through `_extract_json` and the segments not yet yielded
+        follow; ValueError is raised if that fails too. Pass a parser to read
+        the full response from `parser.text` afterwards.
+        """
+        parser = parser if parser is not None else ScriptSegmentParser()
+        emitted = dict.fromkeys(ScriptSegmentParser.SEGMENT_KEYS, 0)
+        for chunk in self.generate_script(topic, duration, key_points):
+            for key, item in parser.feed(chunk):
+                emitted[key] += 1
+                yield key, item
+        if parser.failed or not parser.complete or not any(emitted.values()):
+            script = self._extract_json(parser.text)
+            if not script:
+                raise ValueError("JSON extraction failed: no script in response")
+            for key, count in emitted.items():
+                for item in (script.get(key) or [])[count:]:
+                    yield key, item
+    
     def refine_script(self, existing_script: Dict, feedback: str) -> Generator[str, None, None]:
         prompt = f"""Refine this script based on feedback:
-        Existing Script: {json.dumps(existing_script, indent=2)}
+        Existing Script: {dumps(existing_script, indent=False)}
         Feedback: {feedback}
         Maintain structure, valid parameters, and timestamp continuity."""
         
-        buffer = ""
-        for chunk in self._generate_content(prompt):
-            buffer += chunk
+        for chunk in _iter_sync(self._generate_content(prompt)):
             yield chunk  # Stream refinement updates
     
-    def save_script(self, script: Dict, filename: str) -> None:
-        with open(filename, 'w') as f:
-            json.dump(script, f, indent=2)
+    def save_script(self, script: Union[Dict, Script], filename: str) -> None:
+        if isinstance(script, msgspec.Struct):
+            script = msgspec.to_builtins(script)
+        write_json(script, filename)
+
+# Shared instance: reuse it instead of constructing a generator per call
+GENERATOR = VideoScriptGenerator()
 
 # Example Usage
 if __name__ == "__main__":
-    generator = VideoScriptGenerator()
+    generator = GENERATOR
     try:
         print("Generating Script...")
         script_chunks = generator.generate_script(
@@ -220,12 +659,12 @@ if __name__ == "__main__":
             key_points=["History of Hot Wheels", "Rare models", "Future designs"]
         )
         
-        full_script = ""
+        full_script_parts = []
         for chunk in script_chunks:
             print(chunk, end="", flush=True)  # Print streaming data in real time
-            full_script += chunk
+            full_script_parts.append(chunk)
         
-        script_json = generator._extract_json(full_script)
+        script_json = generator._extract_json("".join(full_script_parts))
         generator.save_script(script_json, "scripts.json")
 
         feedback = input("\nProvide feedback (or type 'no' to skip refinement): ")
@@ -233,12 +672,12 @@ if __name__ == "__main__":
             print("Refining Script...")
             refined_chunks = generator.refine_script(script_json, feedback)
             
-            full_refined_script = ""
+            full_refined_script_parts = []
             for chunk in refined_chunks:
                 print(chunk, end="", flush=True)
-                full_refined_script += chunk
+                full_refined_script_parts.append(chunk)
             
-            refined_json = generator._extract_json(full_refined_script)
+            refined_json = generator._extract_json("".join(full_refined_script_parts))
             generator.save_script(refined_json, "scripts.json")
     except Exception as e:
         print(f"Script generation failed: {str(e)}")
@@ -0,0 +1,59 @@
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'diffusion', 'scripts'))
+
+from jsonutil import dumps, extract_json, loads, write_json  # noqa: E402
+
+SCRIPT = {
+    "topic": "Black holes",
+    "audio_script": [{"timestamp": "00:00", "text": "Gravity {wins} \"always\""}],
+    "visual_script": [{"timestamp_start": "00:00", "timestamp_end": "00:05", "prompt": "An event horizon"}],
+}
+
+
+def test_extract_json_bare():
+    assert extract_json(json.dumps(SCRIPT)) == SCRIPT
+
+
+def test_extract_json_fenced():
+    text = 'Sure!\n```json\n' + json.dumps(SCRIPT) + '\n```\nEnjoy.'
+    assert extract_json(text) == SCRIPT
+
+
+def test_extract_json_prose_wrapped():
+    text = 'Here is your script: ' + json.dumps(SCRIPT) + ' Let me know {if} you need changes.'
+    assert extract_json(text) == SCRIPT
+
+
+def test_extract_json_skips_invalid_candidates():
+    text = 'Fill in {topic} as asked: ' + json.dumps(SCRIPT)
+    assert extract_json(text) == SCRIPT
+
+
+def test_extract_json_truncated():
+    # The nested items are complete objects, but only the top level counts
+    text = 'Here: ' + json.dumps(SCRIPT)[:-20]
+    with pytest.raises(ValueError):
+        extract_json(text)
+
+
+def test_extract_json_without_object():
+    assert extract_json('No JSON here.') == {}
+
+
+def test_dumps_compact_and_indented():
+    assert loads(dumps(SCRIPT, indent=False)) == SCRIPT
+    assert '\n' not in dumps(SCRIPT, indent=False)
+    assert '\n  "topic"' in dumps(SCRIPT)
+
+
+def test_write_json(tmp_path):
+    path = tmp_path / 'script.json'
+    write_json(SCRIPT, str(path))
+    text = path.read_text(encoding='utf-8')
+    assert text.endswith('}\n')
+    assert json.loads(text) == SCRIPT
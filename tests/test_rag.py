@@ -0,0 +1,93 @@
+import asyncio
+import json
+import os
+import re
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'diffusion', 'scripts'))
+
+pytest.importorskip('google.generativeai')
+pytest.importorskip('serpapi')
+
+import rag  # noqa: E402
+
+OUTLINE = {
+    "topic": "Neural networks",
+    "overall_narrative": "From neurons to models",
+    "key_sections": [
+        {"section_title": f"Part {i}", "narration_text": f"Narration {i}", "visual_description": f"Visual {i}"}
+        for i in range(1, 4)
+    ],
+}
+
+
+class FakeModel:
+    """Stands in for genai.GenerativeModel: `reply(system_prompt, prompt)` gives the response text."""
+
+    def __init__(self, reply):
+        self.reply = reply
+        self.prompts = []
+
+    async def generate_content_async(self, contents):
+        system_prompt, prompt = contents
+        self.prompts.append(prompt)
+        return SimpleNamespace(text=self.reply(system_prompt, prompt))
+
+
+def _section_reply(prompt):
+    start, end = re.search(r'start at (\d\d:\d\d) and end by (\d\d:\d\d)', prompt).groups()
+    title = re.search(r'"section_title":"([^"]*)"', prompt).group(1)
+    return json.dumps({
+        "description": "Segmented",
+        "audio_script": [{"timestamp": start, "text": title}],
+        "visual_script": [{"timestamp_start": start, "timestamp_end": end, "prompt": title}],
+    })
+
+
+def _generator(section_reply=_section_reply, outline=OUTLINE):
+    generator = rag.VideoScriptGenerator(api_key='test', serp_api_key='test')
+    generator._search_web = lambda query: 'Web facts'
+
+    def reply(system_prompt, prompt):
+        if system_prompt is generator.system_prompt_initial:
+            return '```json\n' + json.dumps(outline) + '\n```'
+        return section_reply(prompt)
+    generator.model = FakeModel(reply)
+    return generator
+
+
+def test_sections_segmented_separately_and_merged_in_order():
+    generator = _generator()
+    script = asyncio.run(generator.generate_script('Neural networks', duration=60))
+    section_prompts = generator.model.prompts[1:]
+    assert len(section_prompts) == 3
+    assert all('"additional_context":"Web facts"' in prompt for prompt in section_prompts)
+    assert script['topic'] == 'Neural networks'
+    assert [item['text'] for item in script['audio_script']] == ['Part 1', 'Part 2', 'Part 3']
+    assert [(item['timestamp_start'], item['timestamp_end']) for item in script['visual_script']] == [
+        ('00:00', '00:20'), ('00:20', '00:40'), ('00:40', '01:00')]
+
+
+def test_last_section_takes_remainder():
+    script = asyncio.run(_generator().generate_script('Neural networks', duration=62))
+    assert script['visual_script'][-1]['timestamp_start'] == '00:40'
+    assert script['visual_script'][-1]['timestamp_end'] == '01:02'
+
+
+def test_short_video_uses_single_request():
+    whole = {"topic": "ignored", "audio_script": [{"timestamp": "00:00"}], "visual_script": []}
+    generator = _generator(section_reply=lambda prompt: json.dumps(whole))
+    script = asyncio.run(generator.generate_script('Neural networks', duration=10))
+    assert len(generator.model.prompts) == 2
+    assert 'Here is the initial script draft' in generator.model.prompts[1]
+    assert script == dict(whole, topic='Neural networks')
+
+
+def test_empty_section_reply_raises():
+    def section_reply(prompt):
+        return 'I could not segment this.' if 'Part 2' in prompt else _section_reply(prompt)
+    with pytest.raises(ValueError, match=r'section 2 \(Part 2\)'):
+        asyncio.run(_generator(section_reply).generate_script('Neural networks', duration=60))
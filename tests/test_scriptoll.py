@@ -0,0 +1,364 @@
+import asyncio
+import json
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'diffusion', 'scripts'))
+
+import scriptoll  # noqa: E402
+from scriptoll import LLMCache, ScriptSegmentParser, VideoScriptGenerator  # noqa: E402
+
+SCRIPT = {
+    "topic": "Black holes",
+    "description": "A short tour",
+    "audio_script": [
+        {"timestamp": "00:00", "text": "Gravity {wins} \"always\"", "speaker": "default",
+         "speed": 1.0, "pitch": 1.0, "emotion": "neutral"},
+        {"timestamp": "00:05", "text": "Light bends]", "speaker": "narrator_male",
+         "speed": 0.9, "pitch": 1.1, "emotion": "dramatic"},
+    ],
+    "visual_script": [
+        {"timestamp_start": "00:00", "timestamp_end": "00:05", "prompt": "An event horizon",
+         "negative_prompt": "blurry", "style": "cinematic", "guidance_scale": 12.0,
+         "steps": 60, "seed": 1, "width": 1024, "height": 576},
+    ],
+}
+
+
+class Clients(list):
+    """FakeClients created during a test; `reply` sets what they stream back."""
+
+    def reply(self, prompt):
+        return prompt.upper()
+
+
+class FakeClient:
+    """Stands in for ollama.AsyncClient: streams `reply(prompt)` in small chunks."""
+
+    def __init__(self, reply=lambda prompt: prompt.upper()):
+        self.reply = reply
+        self.prompts = []
+        self.closed = False
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def chat(self, model, messages, stream, options, keep_alive):
+        prompt = messages[-1]['content']
+        self.prompts.append(prompt)
+        text = self.reply(prompt)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+        async def chunks():
+            try:
+                for i in range(0, len(text), 4):
+                    await asyncio.sleep(0)
+                    yield {'message': {'content': text[i:i + 4]}}
+            finally:
+                self.in_flight -= 1
+        return chunks()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.closed = True
+
+
+@pytest.fixture
+def clients(monkeypatch):
+    created = Clients()
+
+    def new_client():
+        created.append(FakeClient(lambda prompt: created.reply(prompt)))
+        return created[-1]
+    monkeypatch.setattr(scriptoll, '_new_client', new_client)
+    monkeypatch.setattr(scriptoll, '_sync_client', None)
+    return created
+
+
+def _feed_all(parser, chunks):
+    ready = []
+    for chunk in chunks:
+        ready.extend(parser.feed(chunk))
+    return ready
+
+
+def _expected_segments():
+    return ([('audio_script', item) for item in SCRIPT['audio_script']]
+            + [('visual_script', item) for item in SCRIPT['visual_script']])
+
+
+# Sync shim and concurrent generation
+
+def test_iter_sync_closes_generator_on_early_exit():
+    closed = []
+
+    async def numbers():
+        try:
+            for i in range(10):
+                yield i
+        finally:
+            closed.append(True)
+    chunks = scriptoll._iter_sync(numbers())
+    assert next(chunks) == 0
+    chunks.close()
+    assert closed == [True]
+
+
+def test_sync_api_inside_running_loop(clients):
+    async def caller():
+        return ''.join(VideoScriptGenerator().generate_script('hello'))
+    assert 'HELLO' in asyncio.run(caller())
+
+
+def test_agenerate_many_limits_concurrency(clients):
+    prompts = [f'prompt {i}' for i in range(10)]
+    results = asyncio.run(VideoScriptGenerator().agenerate_many(prompts, limit=3))
+    assert results == [prompt.upper() for prompt in prompts]
+    assert clients[0].max_in_flight == 3
+
+
+def test_agenerate_many_returns_exceptions(clients):
+    def reply(prompt):
+        if prompt == 'boom':
+            raise RuntimeError('model unavailable')
+        return prompt.upper()
+    clients.reply = reply
+    results = asyncio.run(VideoScriptGenerator().agenerate_many(['a', 'boom', 'c']))
+    assert results[0] == 'A' and results[2] == 'C'
+    assert isinstance(results[1], RuntimeError)
+
+
+def test_agenerate_scripts_reports_per_job_errors(clients):
+    # The second reply is cut off mid-script
+    clients.reply = lambda prompt: json.dumps(SCRIPT)[:None if 'Black holes' in prompt else -10]
+    results = asyncio.run(VideoScriptGenerator().agenerate_scripts(
+        [{'topic': 'Black holes'}, {'topic': 'Quasars'}]))
+    assert results[0] == SCRIPT
+    assert isinstance(results[1], ValueError)
+
+
+# ScriptSegmentParser
+
+@pytest.mark.parametrize('size', [1, 3, 7, 64, 10_000])
+def test_parser_chunk_splits(size):
+    text = json.dumps(SCRIPT)
+    parser = ScriptSegmentParser()
+    ready = _feed_all(parser, [text[i:i + size] for i in range(0, len(text), size)])
+    assert ready == _expected_segments()
+    assert not parser.failed
+    assert parser.text == text
+
+
+def test_parser_braces_inside_strings():
+    parser = ScriptSegmentParser()
+    ready = parser.feed(json.dumps(SCRIPT))
+    assert ready[0][1]['text'] == 'Gravity {wins} "always"'
+    assert ready[1][1]['text'] == 'Light bends]'
+
+
+def test_parser_skips_preamble():
+    text = 'Here\'s the "script" you asked for:\n```json\n' + json.dumps(SCRIPT) + '\n```'
+    parser = ScriptSegmentParser()
+    assert _feed_all(parser, [text[i:i + 5] for i in range(0, len(text), 5)]) == _expected_segments()
+    assert not parser.failed
+
+
+def test_parser_flags_broken_segment():
+    parser = ScriptSegmentParser()
+    assert parser.feed('{"audio_script": [{"text": 1,}]}') == []
+    assert parser.failed
+
+
+def test_parser_ignores_text_after_object():
+    parser = ScriptSegmentParser()
+    assert parser.feed(json.dumps(SCRIPT) + ' Or try {"audio_script": [{"a": 1}]}') == _expected_segments()
+    assert parser.complete
+
+
+def test_generate_segments_streams_items(clients):
+    clients.reply = lambda prompt: '```json\n' + json.dumps(SCRIPT) + '\n```'
+    assert list(VideoScriptGenerator().generate_segments('Black holes')) == _expected_segments()
+
+
+def test_generate_segments_falls_back_to_extraction(clients):
+    # The aside closes the scanner's object before the script starts
+    text = 'Fill in {topic} as asked: ' + json.dumps(SCRIPT)
+    clients.reply = lambda prompt: text
+    parser = ScriptSegmentParser()
+    assert list(VideoScriptGenerator().generate_segments('Black holes', parser=parser)) == _expected_segments()
+    assert parser.complete and not parser.failed
+
+
+def test_generate_segments_raises_without_script(clients):
+    clients.reply = lambda prompt: 'Sorry, I cannot help with that.'
+    with pytest.raises(ValueError):
+        list(VideoScriptGenerator().generate_segments('Black holes'))
+
+
+def test_generate_segments_raises_on_broken_stream(clients):
+    text = json.dumps(SCRIPT)
+    clients.reply = lambda prompt: text.replace('"dramatic"}', '"dramatic",}')
+    segments = VideoScriptGenerator().generate_segments('Black holes')
+    assert next(segments) == ('audio_script', SCRIPT['audio_script'][0])
+    with pytest.raises(ValueError):
+        next(segments)
+
+
+# LLMCache
+
+def _embedder(vectors, calls):
+    async def embed(prompt):
+        calls.append(prompt)
+        return vectors[prompt]
+    return embed
+
+
+def test_cache_exact_hit_skips_embedding():
+    calls = []
+    cache = LLMCache(embed_model='embed')
+    embed = _embedder({'p': [1.0, 0.0]}, calls)
+    assert asyncio.run(cache.lookup('m', 's', 'p', embed)) == (None, [1.0, 0.0])
+    cache.set('m', 's', 'p', 'answer', [1.0, 0.0])
+    assert asyncio.run(cache.lookup('m', 's', 'p', embed)) == ('answer', None)
+    assert calls == ['p']
+    assert cache.stats() == {'hits': 1, 'semantic_hits': 0, 'misses': 1}
+
+
+def test_cache_ttl_expiry():
+    cache = LLMCache(ttl=0.05)
+    cache.set('m', 's', 'p', 'answer')
+    assert asyncio.run(cache.lookup('m', 's', 'p'))[0] == 'answer'
+    time.sleep(0.1)
+    assert asyncio.run(cache.lookup('m', 's', 'p'))[0] is None
+    assert len(cache.backend) == 0
+
+
+def test_cache_semantic_threshold():
+    vectors = {'a': [1.0, 0.0], 'close': [0.99, 0.05], 'far': [0.5, 0.5]}
+    cache = LLMCache(embed_model='embed', threshold=0.95)
+    embed = _embedder(vectors, [])
+    cache.set('m', 's', 'a', 'answer', vectors['a'])
+    assert asyncio.run(cache.lookup('m', 's', 'close', embed))[0] == 'answer'
+    assert asyncio.run(cache.lookup('m', 's', 'far', embed))[0] is None
+    assert cache.stats() == {'hits': 0, 'semantic_hits': 1, 'misses': 1}
+
+
+def test_cache_semantic_scope():
+    vectors = {'a': [1.0, 0.0], 'b': [1.0, 0.0]}
+    cache = LLMCache(embed_model='embed')
+    embed = _embedder(vectors, [])
+    cache.set('m', 's', 'a', 'answer', vectors['a'])
+    assert asyncio.run(cache.lookup('other-model', 's', 'b', embed))[0] is None
+    assert asyncio.run(cache.lookup('m', 'other-system', 'b', embed))[0] is None
+    assert asyncio.run(cache.lookup('m', 's', 'b', embed))[0] == 'answer'
+
+
+def test_cache_is_opt_in():
+    assert VideoScriptGenerator().cache is None
+
+
+# _validate_script
+
+def test_validate_script_accepts_valid():
+    assert VideoScriptGenerator()._validate_script(SCRIPT)
+
+
+@pytest.mark.parametrize('mutate', [
+    lambda s: s['audio_script'][0].update(speed='1.0'),
+    lambda s: s['visual_script'][0].pop('prompt'),
+    lambda s: s['visual_script'][0].update(steps=10),
+    lambda s: s.pop('topic'),
+])
+def test_validate_script_rejects_invalid(mutate):
+    script = json.loads(json.dumps(SCRIPT))
+    mutate(script)
+    with pytest.raises(ValueError):
+        VideoScriptGenerator()._validate_script(script)
+
+
+def test_decode_script_drops_extra_keys():
+    text = 'Script:\n```json\n' + json.dumps(SCRIPT) + '\n```'
+    script = VideoScriptGenerator().decode_script(text.replace('"height": 576', '"height": 576, "strength": 0.8'))
+    assert script.visual_script[0].steps == 60
+    assert not hasattr(script.visual_script[0], 'strength')
+
+
+
+# generate_scripts
+
+def _batch_reply(make_script):
+    def reply(prompt):
+        jobs = json.loads(prompt.split('Jobs:')[1])
+        return 'Here you go:\n```json\n' + json.dumps([make_script(job) for job in jobs]) + '\n```'
+    return reply
+
+
+def test_generate_scripts_batches_to_fit_context(clients):
+    clients.reply = _batch_reply(lambda job: dict(SCRIPT, topic=job['topic']))
+    jobs = [{'topic': f'topic {i}', 'duration': 60} for i in range(7)]
+    scripts = VideoScriptGenerator().generate_scripts(jobs)
+    assert [script['topic'] for script in scripts] == [job['topic'] for job in jobs]
+    prompts = clients[0].prompts
+    assert len(prompts) > 1
+    assert all(len(json.loads(prompt.split('Jobs:')[1])) * 60 * scriptoll.SCRIPT_TOKENS_PER_SECOND
+               < scriptoll.OLLAMA_NUM_CTX for prompt in prompts)
+
+
+def test_generate_scripts_reports_invalid_elements(clients):
+    def make_script(job):
+        script = json.loads(json.dumps(SCRIPT))
+        script['topic'] = job['topic']
+        if job['topic'] == 'bad':
+            script['visual_script'][0]['steps'] = 10
+        return script
+    clients.reply = _batch_reply(make_script)
+    scripts = VideoScriptGenerator().generate_scripts([{'topic': 'good'}, {'topic': 'bad'}])
+    assert scripts[0]['topic'] == 'good'
+    assert isinstance(scripts[1], ValueError)
+
+
+def test_generate_scripts_reports_short_batches(clients):
+    def reply(prompt):
+        jobs = json.loads(prompt.split('Jobs:')[1])
+        return json.dumps([dict(SCRIPT, topic=job['topic']) for job in jobs][:-1])
+    clients.reply = reply
+    scripts = VideoScriptGenerator().generate_scripts([{'topic': 'a', 'duration': 30}, {'topic': 'b', 'duration': 30}])
+    assert all(isinstance(script, ValueError) for script in scripts)
+
+
+def test_extract_json_array():
+    generator = VideoScriptGenerator()
+    assert generator._extract_json_array('Sure: [{"a": 1}] done [2]') == [{'a': 1}]
+    with pytest.raises(ValueError):
+        generator._extract_json_array('[{"a": 1}')
+    with pytest.raises(ValueError):
+        generator._extract_json_array('{"a": 1}')
+
+
+# Client pooling
+
+def test_batch_shares_one_client_and_closes_it(clients):
+    for _ in range(3):
+        assert asyncio.run(VideoScriptGenerator().agenerate_many(['a', 'b', 'c'])) == ['A', 'B', 'C']
+    assert len(clients) == 3
+    assert all(client.closed and len(client.prompts) == 3 for client in clients)
+
+
+def test_single_async_call_closes_its_client(clients):
+    async def run():
+        return [chunk async for chunk in VideoScriptGenerator()._generate_content('hello')]
+    assert ''.join(asyncio.run(run())) == 'HELLO'
+    assert len(clients) == 1 and clients[0].closed
+
+
+def test_sync_shim_keeps_one_client(clients):
+    generator = VideoScriptGenerator()
+    assert 'ONE' in ''.join(generator.generate_script('one'))
+    assert 'TWO' in ''.join(generator.generate_script('two'))
+    assert len(clients) == 1 and not clients[0].closed
+    assert len(clients[0].prompts) == 2